@@ -1,22 +1,99 @@
 """
 Parses an EPUB file into a structured object that can be used to serve the book via a web interface.
+
+HTML is parsed with lxml (`pip install lxml`, a declared dependency) for speed; if it is not
+importable, BeautifulSoup's pure-Python html.parser is used instead (slower, and it may
+repair malformed markup differently).
 """
 
 import os
+import re
+import sys
+import html
+import json
+import uuid
 import pickle
 import shutil
-from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Any
+import warnings
+import multiprocessing
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field, fields, asdict, MISSING
+from functools import lru_cache, cached_property
+from itertools import chain
+from typing import List, Dict, Optional, Any, Tuple, Iterator
 from datetime import datetime
 from urllib.parse import unquote
 
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup, Comment, Tag, NavigableString
+from bs4 import BeautifulSoup, Comment, Tag, NavigableString, SoupStrainer, XMLParsedAsHTMLWarning
+
+# Prefer the C-based lxml parser; html.parser is pure Python and dominates ingestion time.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Spine documents are XHTML (<?xml ...?> prolog) and are parsed as HTML on purpose;
+# without this lxml warns once per process, i.e. once per pool worker on every upload
+warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+
+# Large buffer for pickle reads/writes: fewer syscalls than the default 8KB
+IO_BUFFER_SIZE = 1 << 20
+
+# Threads used to write extracted images to disk
+IMAGE_WRITE_WORKERS = 8
+
+class _SafeFilenameTable(dict):
+    """
+    str.translate table keeping letters, digits and '._-' (any script), deleting everything else.
+    Code points are classified on first sight and memoized, so translate stays in C afterwards.
+    """
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        c = chr(codepoint)
+        keep = c.isalpha() or c.isdigit() or c in '._-'
+        self[codepoint] = codepoint if keep else None
+        return self[codepoint]
+
+_SAFE_FILENAME_TABLE = _SafeFilenameTable()
+
+# Below this many spine documents, process_epub parses in-process instead of starting a pool
+PARALLEL_MIN_DOCUMENTS = 8
+
+# Start method for the parsing pool. process_epub also runs inside the (multi-threaded) server,
+# and forking a threaded process can deadlock, so never rely on the platform's "fork" default.
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Any tag, for fast_plain_text
+_TAG_RE = re.compile(r'<[^>]+>')
+
+# Only <body> is ever inspected, so skip building <head>/<meta>/<style> subtrees.
+BODY_STRAINER = SoupStrainer('body')
+# Cheap pre-check deciding whether the strainer can be used at all
+_BODY_TAG_RE = re.compile(r'<body[\s>/]', re.IGNORECASE)
 
 # --- Data structures ---
 
-@dataclass
+def _restore_state(self, state):
+    """
+    __setstate__ for the slotted dataclasses below.
+    Accepts pickles written before slots were added (state is the old __dict__) as well as
+    the (None, slot_state) tuple used now; fields missing from older pickles get their defaults.
+    """
+    if isinstance(state, tuple):
+        state = state[1] or {}
+    for f in fields(self):
+        if f.name in state:
+            setattr(self, f.name, state[f.name])
+        elif f.default is not MISSING:
+            setattr(self, f.name, f.default)
+        elif f.default_factory is not MISSING:
+            setattr(self, f.name, f.default_factory())
+
+
+@dataclass(slots=True)
 class ChapterContent:
     """
     Represents a logical chapter unit to be displayed.
@@ -29,8 +106,10 @@ class ChapterContent:
     text: str         # Plain text
     order: int        # Linear reading order
 
+    __setstate__ = _restore_state
+
 
-@dataclass
+@dataclass(slots=True)
 class TOCEntry:
     """Represents a logical entry in the navigation sidebar."""
     title: str
@@ -39,8 +118,10 @@ class TOCEntry:
     anchor: str       # just the anchor (e.g., 'chapter1'), empty if none
     children: List['TOCEntry'] = field(default_factory=list)
 
+    __setstate__ = _restore_state
 
-@dataclass
+
+@dataclass(slots=True)
 class BookMetadata:
     """Metadata"""
     title: str
@@ -52,10 +133,12 @@ class BookMetadata:
     identifiers: List[str] = field(default_factory=list)
     subjects: List[str] = field(default_factory=list)
 
+    __setstate__ = _restore_state
+
 
-@dataclass
+@dataclass(slots=True)
 class Book:
-    """The Master Object to be pickled."""
+    """The Master Object produced by `process_epub` (stored on disk by `save_to_pickle`)."""
     metadata: BookMetadata
     spine: List[ChapterContent]  # The logical reading order (can be split files)
     toc: List[TOCEntry]          # The navigation tree
@@ -65,7 +148,13 @@ class Book:
     source_file: str
     processed_at: str
     cover_image: Optional[str] = None # Path to cover image relative to book root
-    version: str = "3.2" # Bumped version for cover support
+    version: str = "4.0" # Bumped version for per-chapter on-disk layout
+
+    __setstate__ = _restore_state
+
+    def chapter_hrefs(self) -> List[str]:
+        """Hrefs of the spine in reading order (index == ChapterContent.order)."""
+        return [ch.href for ch in self.spine]
 
 
 # --- Utilities ---
@@ -94,46 +183,49 @@ def extract_plain_text(soup: BeautifulSoup) -> str:
     return ' '.join(text.split())
 
 
-def parse_toc_recursive(toc_list, depth=0) -> List[TOCEntry]:
+def fast_plain_text(html_str: str) -> str:
     """
-    Recursively parses the TOC structure from ebooklib.
+    Same result as `extract_plain_text` for HTML that went through `clean_html_content`,
+    but works on the serialized string: strip tags, unescape entities, collapse whitespace.
+    No DOM walk; the tag scan is a single C-level regex pass.
     """
-    result = []
+    text = html.unescape(_TAG_RE.sub(' ', html_str))
+    return ' '.join(text.split())
 
-    for item in toc_list:
-        # ebooklib TOC items are either `Link` objects or tuples (Section, [Children])
-        if isinstance(item, tuple):
-            section, children = item
-            entry = TOCEntry(
-                title=section.title,
-                href=section.href,
-                file_href=section.href.split('#')[0],
-                anchor=section.href.split('#')[1] if '#' in section.href else "",
-                children=parse_toc_recursive(children, depth + 1)
-            )
-            result.append(entry)
-        elif isinstance(item, epub.Link):
-            entry = TOCEntry(
-                title=item.title,
-                href=item.href,
-                file_href=item.href.split('#')[0],
-                anchor=item.href.split('#')[1] if '#' in item.href else ""
-            )
-            result.append(entry)
-        # Note: ebooklib sometimes returns direct Section objects without children
-        elif isinstance(item, epub.Section):
-             entry = TOCEntry(
-                title=item.title,
-                href=item.href,
-                file_href=item.href.split('#')[0],
-                anchor=item.href.split('#')[1] if '#' in item.href else ""
-            )
-             result.append(entry)
-    
+
+def _make_toc_entry(title: str, href: str) -> TOCEntry:
+    file_href, _, anchor = href.partition('#')
+    # Many entries point into the same file; one shared string keeps toc.pkl (via pickle's memo) small
+    file_href = sys.intern(file_href)
     # Clean titles (limit length)
-    for entry in result:
-        if len(entry.title) > 80:
-            entry.title = entry.title[:80] + "..."
+    if len(title) > 80:
+        title = title[:80] + "..."
+    return TOCEntry(title=title, href=href, file_href=file_href, anchor=anchor)
+
+
+def parse_toc_recursive(toc_list, depth=0) -> List[TOCEntry]:
+    """
+    Parses the (nested) TOC structure from ebooklib.
+    Walks the tree with an explicit work stack rather than Python recursion.
+    """
+    result = []
+    # Each item: (ebooklib toc list, list of TOCEntry to fill)
+    stack = [(toc_list, result)]
+
+    while stack:
+        items, out = stack.pop()
+        for item in items:
+            # ebooklib TOC items are either `Link` objects or tuples (Section, [Children])
+            if isinstance(item, tuple):
+                section, children = item
+                entry = _make_toc_entry(section.title, section.href)
+                stack.append((children, entry.children))
+                out.append(entry)
+            elif isinstance(item, epub.Link):
+                out.append(_make_toc_entry(item.title, item.href))
+            # Note: ebooklib sometimes returns direct Section objects without children
+            elif isinstance(item, epub.Section):
+                out.append(_make_toc_entry(item.title, item.href))
 
     return result
 
@@ -176,81 +268,227 @@ def extract_metadata_robust(book_obj) -> BookMetadata:
     )
 
 def flatten_toc(toc_entries: List[TOCEntry]) -> List[TOCEntry]:
-    """Returns a flat list of all TOC entries for easier lookup."""
+    """Returns a flat list of all TOC entries (depth-first, document order) for easier lookup."""
     flat = []
-    for entry in toc_entries:
+    stack = list(reversed(toc_entries))
+    while stack:
+        entry = stack.pop()
         flat.append(entry)
         if entry.children:
-            flat.extend(flatten_toc(entry.children))
+            stack.extend(reversed(entry.children))
     return flat
 
-def split_html_by_anchors(soup: BeautifulSoup, anchors: List[str]) -> Dict[str, str]:
+def iter_html_segments(soup: BeautifulSoup, anchors: List[str]) -> Iterator[Tuple[str, str, str]]:
     """
     Splits the DOM tree in `soup` based on a list of anchor IDs.
     Strategy: 
       1. Find all anchor elements.
       2. Identify their top-level parent (direct child of body).
-      3. Iterate through body's children, bucketizing them into segments based on the most recently seen anchor parent.
+      3. Serialize body once and cut it in front of each of those parents, so every segment is a
+         contiguous run of body children.
     
-    Returns: {anchor_id: html_string}
+    Yields: (anchor_id, html_string, plain_text) in body order.
     The segment before the first anchor is keyed as 'START'.
+    Plain text is computed per segment as it is yielded, so callers never need to re-parse a segment.
+    The tree is only read up to the first yield; `soup` must stay alive until then.
     """
     body = soup.find('body')
     if not body:
-        return {'START': str(soup)}
-
-    # Map anchor_id -> Element
-    anchor_map = {}
+        html_str = str(soup)
+        yield 'START', html_str, fast_plain_text(html_str)
+        return
+
+    # Nothing to split on (the common case): skip the anchor lookups entirely
+    if not anchors:
+        html_str = body.decode_contents()
+        yield 'START', html_str, fast_plain_text(html_str)
+        return
+
+    # Map anchor_id -> the direct child of body that contains it ("split point").
+    # One walk over each top-level child's subtree records the first element carrying each
+    # wanted id / name together with that top-level child, so no find() per anchor and no
+    # climbing back up through .parent afterwards.
+    anchor_set = frozenset(anchors)
+    by_id: Dict[str, Tag] = {}   # id attribute -> top-level child
+    by_name: Dict[str, Tag] = {} # name attribute -> top-level child
+    # This loop runs once per DOM node, so the type and the attrs dict are looked up once per tag
+    _Tag = Tag
+    for top in tuple(body.contents):
+        if not isinstance(top, _Tag):
+            continue
+        for tag in chain((top,), top.descendants):
+            if not isinstance(tag, _Tag):
+                continue
+            attrs = tag.attrs
+            if not attrs:
+                continue
+            tag_id = attrs.get('id')
+            if tag_id in anchor_set and tag_id not in by_id:
+                by_id[tag_id] = top
+            tag_name = attrs.get('name')
+            if tag_name in anchor_set and tag_name not in by_name:
+                by_name[tag_name] = top
+
+    # Keyed by id(element): Tag.__eq__ compares whole subtrees, identity is all we need
+    split_points: Dict[int, str] = {} # id(Element) -> anchor_id
     for aid in anchors:
-        # IDs are unique
-        elem = soup.find(id=aid) or soup.find(attrs={"name": aid})
-        if elem:
-            anchor_map[aid] = elem
+        # IDs are unique; fall back to <a name="...">
+        top = by_id.get(aid) or by_name.get(aid)
+        # If multiple anchors are in the same block we can't split inside it;
+        # the first one (in TOC order) claims the block.
+        if top is not None and id(top) not in split_points:
+            split_points[id(top)] = aid
     
     # If no anchors found in DOM, return whole
-    if not anchor_map:
-        return {'START': "".join([str(c) for c in body.contents])}
+    if not split_points:
+        html_str = body.decode_contents()
+        yield 'START', html_str, fast_plain_text(html_str)
+        return
+
+    # Serialize body once and cut it at the split points, instead of one str() per child.
+    # Each split point only ever starts one segment, so segments are contiguous runs of children:
+    # a unique marker string is inserted in front of each split point, the whole body is decoded
+    # in a single call, the string is split on the marker, and the markers are removed again.
+    marker = f"\x00split-{uuid.uuid4().hex}\x00"
+    keys: List[str] = ['START']
+    markers: List[NavigableString] = []
+    body_children = list(body.contents)
+    for i, child in enumerate(body_children):
+        # Is this child a split point?
+        aid = split_points.get(id(child))
+        if aid is not None:
+            m = NavigableString(marker)
+            # Position accounts for the markers already inserted before it
+            body.insert(i + len(markers), m)
+            markers.append(m)
+            keys.append(aid)
+
+    pieces = body.decode_contents().split(marker)
+    for m in markers:
+        m.extract()
+
+    # Segment text comes from the serialized HTML
+    for key, html_str in zip(keys, pieces):
+        yield key, html_str, fast_plain_text(html_str)
+
+
+def split_html_by_anchors(soup: BeautifulSoup, anchors: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Dict form of `iter_html_segments`.
+    Returns: {anchor_id: (html_string, plain_text)}
+    """
+    return {key: (html_str, text) for key, html_str, text in iter_html_segments(soup, anchors)}
+
+def _write_file(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# --- Main Conversion Logic ---
 
-    # Identify "Split Points": The direct children of body that contain the anchors
-    # We walk up from the anchor element until we hit body.
-    split_points = {} # Element -> anchor_id
+# The book's image map (internal path -> local path), shared by every spine document.
+# Set once per worker process by the pool initializer rather than pickled into each payload.
+_image_map: Dict[str, str] = {}
+
+def _set_image_map(image_map: Dict[str, str]):
+    global _image_map
+    _image_map = image_map
+
+def _process_spine_document(payload) -> List[Tuple[str, str, Optional[str], str, str]]:
+    """
+    Parses, cleans and splits a single spine document.
+    Runs in a worker process, so it only takes picklable input:
+      (raw_bytes, file_name, item_id, toc_anchors, toc_titles_map)
+    Image sources are resolved against `_image_map` (see `_set_image_map`).
+    Returns [(id, href, toc_title or None, html, text)] in body order.
+    The caller assigns `order` and the fallback "Section N" titles.
+    """
+    raw_bytes, file_name, item_id, toc_anchors, toc_titles_map = payload
+    image_map = _image_map
+
+    # Raw content
+    raw_content = raw_bytes.decode('utf-8', errors='ignore')
+    soup = None
+    if _BODY_TAG_RE.search(raw_content):
+        soup = BeautifulSoup(raw_content, HTML_PARSER, parse_only=BODY_STRAINER)
+    if soup is None or not soup.find('body'):
+        # Fragment without <body>: the strainer would drop everything, so parse it all (once)
+        soup = BeautifulSoup(raw_content, HTML_PARSER)
+
+    # A. Fix Images
+    resolved_srcs = {} # src -> local path (or None); the same image is often referenced many times
+    for img in soup.find_all('img'):
+        src = img.get('src', '')
+        if not src: continue
+        if src not in resolved_srcs:
+            # Decode URL, then try the full path before the basename
+            src_decoded = unquote(src)
+            local = image_map.get(src_decoded)
+            if local is None:
+                local = image_map.get(os.path.basename(src_decoded))
+            resolved_srcs[src] = local
+        local = resolved_srcs[src]
+        if local is not None:
+            img['src'] = local
+
+    # B. Clean HTML
+    soup = clean_html_content(soup)
+    
+    # C. Check if we need to split this file
+    # Perform split
+    # If no anchors in TOC or only 1, maybe we don't strictly need to split?
+    # But if the file is huge and has 1 anchor halfway through...
+    # For safety, if there are anchors, we try to split.
+    
+    # TOC anchors that never appear in the source text can't be in the DOM either:
+    # skip the anchor walk altogether when none of them do.
+    # Attribute values may be written with character references (id="caf&#233;"), so only
+    # trust a miss once the text has been checked with its references decoded too.
+    if toc_anchors and not any(a in raw_content for a in toc_anchors):
+        if '&' not in raw_content:
+            toc_anchors = []
+        else:
+            unescaped = html.unescape(raw_content)
+            if not any(a in unescaped for a in toc_anchors):
+                toc_anchors = []
+    segments = iter_html_segments(soup, toc_anchors)
+    
+    # D. Collect Segments (process_epub turns them into ChapterContent)
+    # Keys are anchor_ids (or 'START'), yielded in body order
     
-    for aid, elem in anchor_map.items():
-        parent = elem
-        # Walk up
-        while parent.parent and parent.parent.name != 'body' and parent.parent.name != '[document]':
-            parent = parent.parent
+    result = []
+    for seg_key, seg_html, seg_text in segments:
+        # isspace() tests in place instead of building a stripped copy of the segment
+        if not seg_html or seg_html.isspace():
+            continue
         
-        # parent is now a direct child of body (or body itself if something is weird)
-        # We record that this element starts a new section for 'aid'
-        # Note: if multiple anchors are in the same block, the last one wins? 
-        # No, we want the first one to claim it? Or maybe we can't split inside a block.
-        # We'll use the first one encountered.
-        if parent not in split_points:
-             split_points[parent] = aid
-
-    # Now iterate body contents and bucket
-    segments = {}
-    current_key = 'START'
-    segments[current_key] = []
-
-    for child in body.contents:
-        # Is this child a split point?
-        if child in split_points:
-            current_key = split_points[child]
-            if current_key not in segments:
-                segments[current_key] = []
+        # Determine title
+        seg_title = None
+        if seg_key in toc_titles_map:
+            seg_title = toc_titles_map[seg_key]
+        elif seg_key == 'START':
+            # Maybe this file *starts* with a chapter but has no anchor for it?
+            # Or it's the cover/title page.
+            pass
+
+        # Append segment key to ID to make it unique
+        unique_id = f"{item_id}_{seg_key}" if seg_key != 'START' else item_id
         
-        segments[current_key].append(str(child))
+        # Determine precise href
+        # If this segment is from an anchor, append it. 
+        # If it's START, use filename.
+        if seg_key == 'START':
+            final_href = file_name
+        else:
+            final_href = f"{file_name}#{seg_key}"
+
+        result.append((unique_id, final_href, seg_title, seg_html, seg_text))
+
+    # Segments are plain strings now; break the tree's parent/child cycles so its memory
+    # is released right away instead of waiting for the cyclic garbage collector
+    soup.decompose()
 
-    # Join
-    result = {}
-    for k, v in segments.items():
-        result[k] = "".join(v)
-    
     return result
 
-# --- Main Conversion Logic ---
 
 def process_epub(epub_path: str, output_dir: str) -> Book:
 
@@ -271,24 +509,33 @@ def process_epub(epub_path: str, output_dir: str) -> Book:
     print("Extracting images...")
     image_map = {} # Key: internal_path, Value: local_relative_path
     cover_image_path = None
+    pending_writes = {} # local_path -> bytes
+    possible_covers = [] # local paths of images with 'cover' in their name
 
     for item in book.get_items():
         if item.get_type() == ebooklib.ITEM_IMAGE:
             # Normalize filename
             original_fname = os.path.basename(item.get_name())
             # Sanitize filename for OS
-            safe_fname = "".join([c for c in original_fname if c.isalpha() or c.isdigit() or c in '._-']).strip()
+            safe_fname = original_fname.translate(_SAFE_FILENAME_TABLE).strip()
 
-            # Save to disk
+            # Queue for writing (same sanitized name: the later image wins, as with serial writes)
             local_path = os.path.join(images_dir, safe_fname)
-            with open(local_path, 'wb') as f:
-                f.write(item.get_content())
+            pending_writes[local_path] = item.get_content()
 
             # Map keys: We try both the full internal path and just the basename
             # to be robust against messy HTML src attributes
             rel_path = f"images/{safe_fname}"
             image_map[item.get_name()] = rel_path
             image_map[original_fname] = rel_path
+
+            # The basename is part of the full name, so one check covers both map keys
+            if 'cover' in item.get_name().lower():
+                possible_covers.append(rel_path)
+
+    # Write all images at once; file writes release the GIL so threads overlap the IO
+    with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as executor:
+        list(executor.map(_write_file, pending_writes.keys(), pending_writes.values()))
     
     # Identify Cover Image
     # 1. Check for 'cover-image' in manifest properties (Epub 3)
@@ -324,11 +571,7 @@ def process_epub(epub_path: str, output_dir: str) -> Book:
     # Fallback heuristics: search for 'cover' in filename if not found yet
     if not cover_image_path:
         # Sort by length to prefer shorter names like 'cover.jpg' over 'chapter1_cover.jpg'
-        possible_covers = []
-        for original_name, local_path in image_map.items():
-            if 'cover' in original_name.lower() and original_name != '__COVER__':
-                possible_covers.append(local_path)
-        
+        # (candidates were collected while extracting images)
         if possible_covers:
             # Pick the one that most likely is a cover (shortest name usually)
             cover_image_path = min(possible_covers, key=len)
@@ -356,8 +599,9 @@ def process_epub(epub_path: str, output_dir: str) -> Book:
     
     # 6. Process Content (Logical Splitting)
     print("Processing chapters...")
-    spine_chapters = []
-    global_order = 0
+    payloads = []
+    payload_index = {} # item_id -> index into payloads
+    spine_docs = []    # payload index of each spine document, in reading order
 
     # We iterate over the spine (linear reading order)
     for spine_item in book.spine:
@@ -368,99 +612,59 @@ def process_epub(epub_path: str, output_dir: str) -> Book:
             continue
 
         if item.get_type() == ebooklib.ITEM_DOCUMENT:
+            # A document listed more than once in the spine is parsed only once
+            if item_id in payload_index:
+                spine_docs.append(payload_index[item_id])
+                continue
+
             file_name = item.get_name()
-            
-            # Raw content
-            raw_content = item.get_content().decode('utf-8', errors='ignore')
-            soup = BeautifulSoup(raw_content, 'html.parser')
-
-            # A. Fix Images
-            for img in soup.find_all('img'):
-                src = img.get('src', '')
-                if not src: continue
-                # Decode URL
-                src_decoded = unquote(src)
-                filename = os.path.basename(src_decoded)
-                # Try to find in map
-                if src_decoded in image_map:
-                    img['src'] = image_map[src_decoded]
-                elif filename in image_map:
-                    img['src'] = image_map[filename]
-
-            # B. Clean HTML
-            soup = clean_html_content(soup)
-            
-            # C. Check if we need to split this file
+
             # Get expected anchors for this file from TOC
             toc_anchors = []
             toc_titles_map = {} # anchor -> title
             
             if file_name in file_toc_map:
                 for anch, tit in file_toc_map[file_name]:
-                    toc_anchors.append(anch)
+                    # The titles dict doubles as the seen-set: a TOC that links the
+                    # same anchor twice shouldn't make the splitter look it up twice
+                    if anch not in toc_titles_map:
+                        toc_anchors.append(anch)
                     toc_titles_map[anch] = tit
-            
-            # Perform split
-            # If no anchors in TOC or only 1, maybe we don't strictly need to split?
-            # But if the file is huge and has 1 anchor halfway through...
-            # For safety, if there are anchors, we try to split.
-            
-            segments = split_html_by_anchors(soup, toc_anchors)
-            
-            # D. Create Chapter Objects from Segments
-            # Segments dict keys are anchor_ids (or 'START')
-            # We want to maintain the order they appear in the file.
-            # `split_html_by_anchors` returns a dict, order is not guaranteed in Py < 3.7 (though we use 3.x).
-            # But we generated it by iterating body.
-            
-            # Re-sort segments based on body order? 
-            # Our split function returns them in order of encounter if we iterate body.
-            # But the dict keys might be shuffled? No, Python 3.7+ preserves insertion order.
-            
-            # However, `split_html_by_anchors` as implemented above buckets by key. 
-            # If the body has: Start -> A -> Start -> B -> A
-            # Our simple bucket impl would merge the two 'Start' blocks.
-            # That might be wrong if 'A' is supposed to be a chapter in the middle.
-            # But standard EPUBs usually don't interleave chapters like that.
-            
-            for seg_key, seg_html in segments.items():
-                if not seg_html.strip():
-                    continue
-                
-                # Determine title
-                seg_title = f"Section {global_order+1}"
-                if seg_key in toc_titles_map:
-                    seg_title = toc_titles_map[seg_key]
-                elif seg_key == 'START':
-                    # Maybe this file *starts* with a chapter but has no anchor for it?
-                    # Or it's the cover/title page.
-                    pass
-
-                # Create Object
-                # Append segment key to ID to make it unique
-                unique_id = f"{item_id}_{seg_key}" if seg_key != 'START' else item_id
-                
-                # Determine precise href
-                # If this segment is from an anchor, append it. 
-                # If it's START, use filename.
-                if seg_key == 'START':
-                    final_href = file_name
-                else:
-                    final_href = f"{file_name}#{seg_key}"
-
-                # We need a new soup for text extraction to avoid processing the whole file again
-                seg_soup = BeautifulSoup(seg_html, 'html.parser')
-
-                chapter = ChapterContent(
-                    id=unique_id,
-                    href=final_href, # Important: precise href with anchor
-                    title=seg_title,
-                    content=seg_html,
-                    text=extract_plain_text(seg_soup),
-                    order=global_order
-                )
-                spine_chapters.append(chapter)
-                global_order += 1
+
+            payload_index[item_id] = len(payloads)
+            spine_docs.append(payload_index[item_id])
+            payloads.append((item.get_content(), file_name, item_id, toc_anchors, toc_titles_map))
+
+    # Documents are independent and parsing is CPU bound, so spread them over processes.
+    # Small books are not worth the pool start-up cost.
+    if len(payloads) >= PARALLEL_MIN_DOCUMENTS:
+        # Each worker receives the image map once, through the initializer
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                                 initializer=_set_image_map, initargs=(image_map,)) as executor:
+            results = list(executor.map(_process_spine_document, payloads, chunksize=4))
+    else:
+        _set_image_map(image_map)
+        try:
+            results = [_process_spine_document(payload) for payload in payloads]
+        finally:
+            _set_image_map({})
+
+    # Assign the linear reading order (and fallback titles) across all documents
+    spine_chapters = []
+    global_order = 0
+
+    for segments in (results[i] for i in spine_docs):
+        for unique_id, final_href, toc_title, seg_html, seg_text in segments:
+            chapter = ChapterContent(
+                id=unique_id,
+                href=final_href, # Important: precise href with anchor
+                title=toc_title if toc_title is not None else f"Section {global_order+1}",
+                content=seg_html,
+                text=seg_text,
+                order=global_order
+            )
+            spine_chapters.append(chapter)
+            global_order += 1
 
     # 7. Final Assembly
     final_book = Book(
@@ -477,17 +681,153 @@ def process_epub(epub_path: str, output_dir: str) -> Book:
 
 
 def save_to_pickle(book: Book, output_dir: str):
-    p_path = os.path.join(output_dir, 'book.pkl')
-    with open(p_path, 'wb') as f:
-        pickle.dump(book, f)
-    print(f"Saved structured data to {p_path}")
+    """
+    Stores the book as several small files so readers only load what they need:
+      metadata.json      - BookMetadata, cover, processed_at and the spine headers (no content)
+      images.json        - the image map
+      toc.pkl            - the TOCEntry tree
+      chapters/NNNN.pkl  - one ChapterContent per spine entry, named by order
+    """
+    chapters_dir = os.path.join(output_dir, 'chapters')
+    os.makedirs(chapters_dir, exist_ok=True)
+
+    for chapter in book.spine:
+        c_path = os.path.join(chapters_dir, f"{chapter.order:04d}.pkl")
+        with open(c_path, 'wb', buffering=IO_BUFFER_SIZE) as f:
+            pickle.dump(chapter, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with open(os.path.join(output_dir, 'toc.pkl'), 'wb', buffering=IO_BUFFER_SIZE) as f:
+        pickle.dump(book.toc, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    with open(os.path.join(output_dir, 'images.json'), 'w') as f:
+        json.dump(book.images, f)
+
+    meta = {
+        "version": book.version,
+        "source_file": book.source_file,
+        "processed_at": book.processed_at,
+        "cover_image": book.cover_image,
+        "metadata": asdict(book.metadata),
+        "spine": [
+            {"id": ch.id, "href": ch.href, "title": ch.title, "order": ch.order}
+            for ch in book.spine
+        ],
+    }
+    m_path = os.path.join(output_dir, 'metadata.json')
+    with open(m_path, 'w') as f:
+        json.dump(meta, f)
+    print(f"Saved structured data to {output_dir}")
+
+
+# --- Lazy Loading ---
+
+class BookDataError(Exception):
+    """A file of a processed book folder is missing or can't be unpickled."""
+
+
+def _unpickle(path: str):
+    try:
+        with open(path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+            return pickle.load(f)
+    except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError) as e:
+        # AttributeError/ImportError: the pickle references classes that aren't importable
+        # here, e.g. `__main__.ChapterContent` from a book written by an older CLI run
+        raise BookDataError(f"Can't load {path}: {e}") from e
+
+
+@lru_cache(maxsize=64)
+def _load_chapter(path: str, stamp: str) -> ChapterContent:
+    # `stamp` (processed_at) is part of the key so a re-processed book never hits stale entries
+    return _unpickle(path)
+
+
+class LazySpine(Sequence):
+    """List-like spine that unpickles a chapter only when it is indexed."""
+
+    def __init__(self, book_dir: str, headers: List[Dict[str, Any]], stamp: str):
+        self._chapters_dir = os.path.join(book_dir, 'chapters')
+        self._headers = headers
+        self._stamp = stamp
+
+    def __len__(self) -> int:
+        return len(self._headers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("spine index out of range")
+        path = os.path.join(self._chapters_dir, f"{self._headers[index]['order']:04d}.pkl")
+        return _load_chapter(path, self._stamp)
+
+
+class LazyBook:
+    """
+    Read-side counterpart of `Book` for the split on-disk layout.
+    Exposes the same attributes; toc, images and chapter content are read on first access.
+    """
+
+    def __init__(self, book_dir: str):
+        self.book_dir = book_dir
+        with open(os.path.join(book_dir, 'metadata.json'), 'r') as f:
+            meta = json.load(f)
+        self.metadata = BookMetadata(**meta["metadata"])
+        self.source_file = meta["source_file"]
+        self.processed_at = meta["processed_at"]
+        self.cover_image = meta.get("cover_image")
+        self.version = meta.get("version", "4.0")
+        self._spine_headers = meta["spine"]
+        self.spine = LazySpine(book_dir, self._spine_headers, self.processed_at)
+
+    @cached_property
+    def toc(self) -> List[TOCEntry]:
+        return _unpickle(os.path.join(self.book_dir, 'toc.pkl'))
+
+    @cached_property
+    def images(self) -> Dict[str, str]:
+        with open(os.path.join(self.book_dir, 'images.json'), 'r') as f:
+            return json.load(f)
+
+    def chapter_hrefs(self) -> List[str]:
+        return [h["href"] for h in self._spine_headers]
+
+
+def book_mtime(book_dir: str) -> Optional[int]:
+    """
+    Modification time (ns) of the file that marks a book folder as complete:
+    metadata.json (written last by save_to_pickle) or a legacy book.pkl. None if neither exists.
+    """
+    for name in ('metadata.json', 'book.pkl'):
+        try:
+            return os.stat(os.path.join(book_dir, name)).st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+def load_book(book_dir: str):
+    """
+    Opens a processed book folder.
+    Returns a LazyBook for the split layout, the unpickled Book for folders
+    written by older versions (single book.pkl), or None if neither exists.
+    """
+    if os.path.exists(os.path.join(book_dir, 'metadata.json')):
+        return LazyBook(book_dir)
+
+    p_path = os.path.join(book_dir, 'book.pkl')
+    if os.path.exists(p_path):
+        with open(p_path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+            return pickle.load(f)
+
+    return None
 
 
 # --- CLI ---
 
 if __name__ == "__main__":
 
-    import sys
     if len(sys.argv) < 2:
         print("Usage: python reader3.py <file.epub>")
         sys.exit(1)
@@ -496,8 +836,12 @@ if __name__ == "__main__":
     assert os.path.exists(epub_file), "File not found."
     out_dir = os.path.splitext(epub_file)[0] + "_data"
 
-    book_obj = process_epub(epub_file, out_dir)
-    save_to_pickle(book_obj, out_dir)
+    # Run through the importable module, not __main__: the pickles then reference
+    # `reader3.ChapterContent` etc., which the server can load
+    import reader3
+
+    book_obj = reader3.process_epub(epub_file, out_dir)
+    reader3.save_to_pickle(book_obj, out_dir)
     print("\n--- Summary ---")
     print(f"Title: {book_obj.metadata.title}")
     print(f"Authors: {', '.join(book_obj.metadata.authors)}")
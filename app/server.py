@@ -1,19 +1,25 @@
 import os
 import shutil
-import pickle
-import json
+import threading
 from datetime import datetime
-from functools import lru_cache
-from typing import Optional, List, Tuple
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Dict, Union
 
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse
+import orjson
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from reader3 import Book, BookMetadata, ChapterContent, TOCEntry, process_epub, save_to_pickle
+from reader3 import Book, BookMetadata, ChapterContent, TOCEntry, LazyBook, BookDataError, process_epub, save_to_pickle, load_book, book_mtime
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+@app.exception_handler(BookDataError)
+async def book_data_error_handler(request: Request, exc: BookDataError):
+    # A chapter or TOC file that can't be read back is treated like a missing book
+    print(f"Error reading book data: {exc}")
+    return ORJSONResponse(status_code=404, content={"detail": "Book data not readable"})
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
@@ -21,44 +27,190 @@ templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 BOOKS_DIR = os.environ.get("BOOKS_DIR", ".")
 HISTORY_FILE = os.environ.get("HISTORY_FILE", "history.json")
 UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "uploads")
+# Cached library listing, so the library page doesn't open every book
+LIBRARY_INDEX_FILE = os.path.join(BOOKS_DIR, "index.json")
 
 # Ensure directories exist
 for d in [BOOKS_DIR, UPLOAD_DIR, os.path.dirname(HISTORY_FILE)]:
     if d and not os.path.exists(d):
         os.makedirs(d, exist_ok=True)
 
-def get_history() -> dict:
+def _read_history_file() -> dict:
     if os.path.exists(HISTORY_FILE):
         try:
-            with open(HISTORY_FILE, "r") as f:
-                return json.load(f)
+            with open(HISTORY_FILE, "rb") as f:
+                return orjson.loads(f.read())
         except:
             return {}
     return {}
 
-def update_history(book_id: str):
-    history = get_history()
-    history[book_id] = datetime.now().isoformat()
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f)
+# Reading history lives in memory; the file is only read at startup and rewritten in the background.
+_HISTORY = _read_history_file()
+_HISTORY_LOCK = threading.Lock()
+
+# Library index: loaded on first use (see get_library_index)
+_LIBRARY_INDEX: Optional[dict] = None
+_LIBRARY_INDEX_LOCK = threading.Lock()
 
-@lru_cache(maxsize=10)
-def load_book_cached(folder_name: str) -> Optional[Book]:
+def get_history() -> dict:
+    return _HISTORY
+
+def update_history(book_id: str):
+    _HISTORY[book_id] = datetime.now().isoformat()
+
+def save_history():
+    """Writes the history atomically (temp file + rename) so readers never see a partial file."""
+    with _HISTORY_LOCK:
+        data = dict(_HISTORY)
+        tmp_path = HISTORY_FILE + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp_path, HISTORY_FILE)
+
+# Loaded books: folder_name -> [mtime, book, toc/spine index or None], least recently used first
+_BOOK_CACHE: "OrderedDict[str, list]" = OrderedDict()
+BOOK_CACHE_SIZE = 10
+
+def _book_cache_entry(folder_name: str) -> Optional[list]:
     """
-    Loads the book from the pickle file.
-    Cached so we don't re-read the disk on every click.
+    Returns the cache entry for a book, (re)loading it only when its on-disk mtime changed.
+    (Re)processing one book therefore never evicts the others.
     """
-    file_path = os.path.join(BOOKS_DIR, folder_name, "book.pkl")
-    if not os.path.exists(file_path):
+    book_dir = os.path.join(BOOKS_DIR, folder_name)
+    mtime = book_mtime(book_dir)
+    if mtime is None:
+        _BOOK_CACHE.pop(folder_name, None)
         return None
 
+    entry = _BOOK_CACHE.get(folder_name)
+    if entry is not None and entry[0] == mtime:
+        _BOOK_CACHE.move_to_end(folder_name)
+        return entry
+
     try:
-        with open(file_path, "rb") as f:
-            book = pickle.load(f)
-        return book
+        book = load_book(book_dir)
     except Exception as e:
         print(f"Error loading book {folder_name}: {e}")
         return None
+    if book is None:
+        return None
+
+    entry = [mtime, book, None]
+    _BOOK_CACHE[folder_name] = entry
+    _BOOK_CACHE.move_to_end(folder_name)
+    while len(_BOOK_CACHE) > BOOK_CACHE_SIZE:
+        _BOOK_CACHE.popitem(last=False)
+    return entry
+
+def load_book_cached(folder_name: str) -> Optional[Union[LazyBook, Book]]:
+    """
+    Opens the book folder (see `reader3.load_book`).
+    Only metadata is read up front; chapters are loaded on access.
+    Cached so we don't re-read the disk on every click.
+    """
+    entry = _book_cache_entry(folder_name)
+    return entry[1] if entry else None
+
+def invalidate_book_cache(folder_name: str):
+    _BOOK_CACHE.pop(folder_name, None)
+
+def _library_entry(folder_name: str, book: Union[LazyBook, Book]) -> dict:
+    """The per-book fields the library page needs."""
+    # Resolve cover image
+    cover_url = None
+    if book.cover_image:
+        cover_filename = os.path.basename(book.cover_image)
+        cover_url = f"/read/{folder_name}/images/{cover_filename}"
+    elif '__COVER__' in book.images:
+        cover_path = book.images['__COVER__']
+        cover_filename = os.path.basename(cover_path)
+        cover_url = f"/read/{folder_name}/images/{cover_filename}"
+    else:
+        # Runtime fallback for books processed with older version
+        for img_internal_path, img_rel_path in book.images.items():
+            if 'cover' in img_internal_path.lower():
+                cover_filename = os.path.basename(img_rel_path)
+                cover_url = f"/read/{folder_name}/images/{cover_filename}"
+                break
+
+    return {
+        "id": folder_name,
+        "title": book.metadata.title,
+        "author": ", ".join(book.metadata.authors),
+        "chapters": len(book.spine),
+        "cover_url": cover_url,
+        "processed_at": getattr(book, "processed_at", "1970-01-01T00:00:00"),
+        # Lets get_library_index notice a folder that was reprocessed behind our back
+        "mtime": book_mtime(os.path.join(BOOKS_DIR, folder_name)),
+    }
+
+def _read_library_index() -> Optional[dict]:
+    if os.path.exists(LIBRARY_INDEX_FILE):
+        try:
+            with open(LIBRARY_INDEX_FILE, "rb") as f:
+                return orjson.loads(f.read())
+        except:
+            return None
+    return None
+
+def _save_library_index():
+    tmp_path = LIBRARY_INDEX_FILE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(_LIBRARY_INDEX))
+    os.replace(tmp_path, LIBRARY_INDEX_FILE)
+
+def get_library_index() -> dict:
+    """
+    Returns {folder_name: library entry} from index.json (kept in memory).
+    One listdir plus one stat per book reconciles it with BOOKS_DIR: folders that are gone
+    or no longer hold a book are dropped, and folders that are new (e.g. processed via the CLI)
+    or were reprocessed since their entry was written are loaded once and (re)added.
+    """
+    global _LIBRARY_INDEX
+    with _LIBRARY_INDEX_LOCK:
+        changed = False
+        if _LIBRARY_INDEX is None:
+            _LIBRARY_INDEX = _read_library_index()
+            if _LIBRARY_INDEX is None:
+                _LIBRARY_INDEX = {}
+                changed = True
+
+        folders = set()
+        if os.path.exists(BOOKS_DIR):
+            folders = {item for item in os.listdir(BOOKS_DIR) if item.endswith("_data")}
+
+        for item in set(_LIBRARY_INDEX) - folders:
+            del _LIBRARY_INDEX[item]
+            changed = True
+
+        for item in folders:
+            mtime = book_mtime(os.path.join(BOOKS_DIR, item))
+            entry = _LIBRARY_INDEX.get(item)
+            if mtime is None:
+                # Not a (complete) book folder, e.g. a failed re-upload removed it
+                if entry is not None:
+                    del _LIBRARY_INDEX[item]
+                    changed = True
+                continue
+            if entry is not None and entry.get("mtime") == mtime:
+                continue
+            book = load_book_cached(item)
+            if book:
+                _LIBRARY_INDEX[item] = _library_entry(item, book)
+            else:
+                _LIBRARY_INDEX.pop(item, None)
+            changed = True
+
+        if changed:
+            _save_library_index()
+        return _LIBRARY_INDEX
+
+def update_library_index(folder_name: str, book: Book):
+    """Adds or replaces one book's entry after it has been (re)processed."""
+    get_library_index()
+    with _LIBRARY_INDEX_LOCK:
+        _LIBRARY_INDEX[folder_name] = _library_entry(folder_name, book)
+        _save_library_index()
 
 @app.get("/", response_class=HTMLResponse)
 async def library_view(request: Request, sort: Optional[str] = None):
@@ -69,37 +221,8 @@ async def library_view(request: Request, sort: Optional[str] = None):
     # Determine sorting preference: Query param -> Cookie -> Default
     current_sort = sort or request.cookies.get("sort_pref") or "upload"
 
-    # Scan directory for folders ending in '_data' that have a book.pkl
-    if os.path.exists(BOOKS_DIR):
-        for item in os.listdir(BOOKS_DIR):
-            full_path = os.path.join(BOOKS_DIR, item)
-            if item.endswith("_data") and os.path.isdir(full_path):
-                # Try to load it to get the title
-                book = load_book_cached(item)
-                if book:
-                    # Resolve cover image
-                    cover_url = None
-                    if '__COVER__' in book.images:
-                        cover_path = book.images['__COVER__']
-                        cover_filename = os.path.basename(cover_path)
-                        cover_url = f"/read/{item}/images/{cover_filename}"
-                    else:
-                        # Runtime fallback for books processed with older version
-                        for img_internal_path, img_rel_path in book.images.items():
-                            if 'cover' in img_internal_path.lower():
-                                cover_filename = os.path.basename(img_rel_path)
-                                cover_url = f"/read/{item}/images/{cover_filename}"
-                                break
-                        
-                    books.append({
-                        "id": item,
-                        "title": book.metadata.title,
-                        "author": ", ".join(book.metadata.authors),
-                        "chapters": len(book.spine),
-                        "cover_url": cover_url,
-                        "processed_at": getattr(book, "processed_at", "1970-01-01T00:00:00"),
-                        "last_opened": history.get(item, "1970-01-01T00:00:00")
-                    })
+    for entry in get_library_index().values():
+        books.append({**entry, "last_opened": history.get(entry["id"], "1970-01-01T00:00:00")})
 
     # Sorting
     if current_sort == "opened":
@@ -142,30 +265,32 @@ async def upload_books(files: List[UploadFile] = File(...)):
             print(f"Processing uploaded file: {file.filename}...")
             book_obj = process_epub(file_path, output_dir)
             save_to_pickle(book_obj, output_dir)
+            update_library_index(output_dir_name, book_obj)
         except Exception as e:
             print(f"Error processing book {file.filename}: {e}")
             continue
-
-    # Clear cache once after all books are processed
-    load_book_cached.cache_clear()
+        finally:
+            # Only this book changed; keep the rest of the cache warm
+            invalidate_book_cache(output_dir_name)
 
     # 4. Redirect to library
     return RedirectResponse(url="/", status_code=303)
 
 @app.get("/read/{book_id}", response_class=HTMLResponse)
-async def redirect_to_first_chapter(book_id: str):
+async def redirect_to_first_chapter(request: Request, book_id: str, background_tasks: BackgroundTasks):
     """Helper to just go to chapter 0."""
-    return await read_chapter(book_id=book_id, chapter_index=0)
+    return await read_chapter(request=request, book_id=book_id, chapter_index=0, background_tasks=background_tasks)
 
 @app.get("/read/{book_id}/{chapter_index}", response_class=HTMLResponse)
-async def read_chapter(request: Request, book_id: str, chapter_index: int):
+async def read_chapter(request: Request, book_id: str, chapter_index: int, background_tasks: BackgroundTasks):
     """The main reader interface."""
     book = load_book_cached(book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # Update last opened history
+    # Update last opened history (persisted after the response is sent)
     update_history(book_id)
+    background_tasks.add_task(save_history)
 
     if chapter_index < 0 or chapter_index >= len(book.spine):
         raise HTTPException(status_code=404, detail="Chapter not found")
@@ -176,9 +301,12 @@ async def read_chapter(request: Request, book_id: str, chapter_index: int):
     prev_idx = chapter_index - 1 if chapter_index > 0 else None
     next_idx = chapter_index + 1 if chapter_index < len(book.spine) - 1 else None
 
+    _, spine_map = load_book_index(book_id)
+
     return templates.TemplateResponse("reader.html", {
         "request": request,
         "book": book,
+        "spine_map": spine_map,
         "current_chapter": current_chapter,
         "chapter_index": chapter_index,
         "book_id": book_id,
@@ -188,27 +316,40 @@ async def read_chapter(request: Request, book_id: str, chapter_index: int):
 
 def flatten_toc_with_depth(entries: List[TOCEntry], depth=0) -> List[Tuple[TOCEntry, int]]:
     result = []
-    for entry in entries:
-        result.append((entry, depth))
+    stack = [(entry, depth) for entry in reversed(entries)]
+    while stack:
+        entry, d = stack.pop()
+        result.append((entry, d))
         if entry.children:
-            result.extend(flatten_toc_with_depth(entry.children, depth + 1))
+            stack.extend((child, d + 1) for child in reversed(entry.children))
     return result
 
+def load_book_index(folder_name: str) -> Optional[Tuple[List[Tuple[TOCEntry, int]], Dict[str, int]]]:
+    """
+    Returns (flat_toc_with_depth, spine_map) for a book.
+    A loaded Book never changes, so these lookups are built once and kept with its cache entry.
+    """
+    entry = _book_cache_entry(folder_name)
+    if not entry:
+        return None
+    if entry[2] is None:
+        book = entry[1]
+        spine_map = {href: i for i, href in enumerate(book.chapter_hrefs())}
+        entry[2] = (flatten_toc_with_depth(book.toc), spine_map)
+    return entry[2]
+
 @app.get("/api/content/recursive/{book_id}")
 async def get_chapter_content_recursive(book_id: str, href: str):
     """
-    Returns the concatenated content of a chapter and all its sub-chapters.
+    Streams the concatenated HTML of a chapter and all its sub-chapters.
     Identifies the start and end spine indices based on TOC structure.
     """
     book = load_book_cached(book_id)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
 
-    # 1. Build Spine Map (href -> index)
-    spine_map = {ch.href: i for i, ch in enumerate(book.spine)}
-
-    # 2. Flatten TOC to find structure
-    flat_toc = flatten_toc_with_depth(book.toc)
+    # 1 & 2. Spine Map (href -> index) and flattened TOC, cached per book
+    flat_toc, spine_map = load_book_index(book_id)
     
     # 3. Find target entry index in flat_toc
     target_idx = -1
@@ -273,14 +414,19 @@ async def get_chapter_content_recursive(book_id: str, href: str):
     if end_spine_idx < start_spine_idx:
         end_spine_idx = len(book.spine)
 
-    # 6. Collect Content
-    content_parts = []
-    for i in range(start_spine_idx, end_spine_idx):
-        content_parts.append(book.spine[i].content)
-        
-    full_content = "\n<hr class='chapter-divider'>\n".join(content_parts)
-    
-    return {"content": full_content}
+    # 6. Stream Content as raw HTML (no JSON escaping; first chapter goes out immediately)
+    # The first chapter is loaded before streaming starts, so unreadable book data is still a 404
+    first_content = book.spine[start_spine_idx].content if start_spine_idx < end_spine_idx else None
+
+    def iter_content():
+        for i in range(start_spine_idx, end_spine_idx):
+            if i > start_spine_idx:
+                yield "\n<hr class='chapter-divider'>\n"
+                yield book.spine[i].content
+            else:
+                yield first_content
+
+    return StreamingResponse(iter_content(), media_type="text/html")
 
 
 @app.get("/read/{book_id}/images/{image_name}")